@@ -1,412 +1,789 @@
-#!/usr/bin/env python3
-
-import argparse
-import tempfile
-import os
-import logging
-import sys
-import numpy as np
-import re
-import asyncio  # Add this import at the top of your file
-import textwrap  # Import the textwrap module
-import xml.etree.ElementTree as ET
-
-import utils
-from utils import CharacterClip
-
-from os.path import abspath, dirname
-from typing import List, Tuple, Optional
-
-from PIL import Image, ImageDraw, ImageFont
-import matplotlib.font_manager as fm
-import edge_tts
-from loguru import logger
-from moviepy import *
-import cv2 as cv
-
-# The star of the show: VideoMaker class.
-class VideoMaker:
-    ROOT_DIR = abspath(dirname(__file__))
-    CHAR_DIR = os.path.join(ROOT_DIR, "character")  # Correct usage of os.path.join
-    STATICS_DIR = os.path.join(ROOT_DIR, "statics")  # Correct usage of os.path.join
-
-    # Sprite cache.
-    SPRITES: dict = utils.load_sprites_recursively(CHAR_DIR)
-    # Tuple of character images
-    CHARACTER_IMAGES: tuple = utils.get_character_images(SPRITES, CHAR_DIR)
-    CHARACTERS: tuple = tuple(SPRITES.keys())
-    # Get a estimate of the character size
-    CHARACTER_AVERAGE_SIZE: tuple = utils.get_character_average_size(CHARACTER_IMAGES)
-    # Define the RESOLUTION constant
-    RESOLUTION = (1920, 1080)
-    TTS_VOICE = "en-US-AndrewMultilingualNeural"
-
-    def __init__(self, script_path: str, output_path: Optional[str] = None) -> None:
-        """
-        Initialize VideoMaker instance.
-
-        Args:
-            script_path (str): Path to the script file.
-            output_path (Optional[str], optional): Path to save the final video.
-                If not provided, it will use the path in the [END] tag. Defaults to None.
-        """
-        self.script_path = script_path
-        self.output_path = output_path
-        # Initialize the current font
-        self.current_font = fm.findfont(fm.FontProperties(family="Arial"))
-        self.clips = []
-        self.current_time = 0
-
-    @staticmethod
-    async def edge_tts_to_clip(text: str, start_time: float, duration: float = None) -> Tuple[VideoClip, float]:
-        """
-        Convert text to speech using Azure TTS and convert it to a MoviePy clip
-        with the specified start time and duration.
-
-        Args:
-            text (str): Text to convert to speech.
-            start_time (float): Start time of the clip.
-            duration (float, optional): Duration of the clip. Defaults to None.
-
-        Returns:
-            Tuple[VideoClip, float]: A tuple containing the MoviePy clip and the
-                duration of the clip.
-        """
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_audio_file:
-            # Convert text to speech using Google TTS
-            await utils.edge_tts_to_audiofile(text, VideoMaker.TTS_VOICE, tmp_audio_file.name)
-
-            # Define the TTS clip and its duration
-            audio_clip = AudioFileClip(tmp_audio_file.name)
-            audio_duration = audio_clip.duration
-
-            if duration is None:
-                # If no duration is specified, use the audio duration
-                clip_duration = audio_duration
-            elif audio_duration > duration:
-                # If the audio duration is longer than the specified duration, trim it
-                audio_clip: AudioClip = audio_clip.subclipped(0, duration)
-                clip_duration = duration
-            else:
-                # If the audio duration is shorter than the specified duration, use the audio duration
-                clip_duration = audio_duration
-
-            # Create a black video clip with the same duration as the audio clip
-            video_clip = utils.BlackClip((1, 1)).with_duration(clip_duration)
-
-            # Combine the video and audio clips
-            composite_clip = video_clip.with_audio(audio_clip)
-
-            # Set the start time of the clip
-            composite_clip = composite_clip.with_start(start_time)
-
-            return composite_clip, clip_duration
-
-    @staticmethod
-    def read_script(script_path: str) -> str:
-        with open(script_path, "r", encoding="utf-8") as script_file:
-            return script_file.read()
-
-    @staticmethod
-    def create_initial_background_clip(duration: int, resolution: Tuple[int, int]) -> ImageClip:
-        return utils.WhiteClip(resolution).with_duration(duration)
-
-    def add_emotion_clip(self, emotion_name: str, duration: float) -> float:
-        """
-        Adds an emotion clip to the video.
-
-        Args:
-            emotion_name (str): The name of the emotion to add.
-            duration (float): The duration of the clip.
-
-        Returns:
-            float: The updated current time of the video.
-        """
-        # Get the emotion clip from the SPRITES dictionary based on the emotion name.
-        emotion_clip = CharacterClip(emotion_name, \
-                                    VideoMaker.CHARACTERS, \
-                                    VideoMaker.CHAR_DIR, \
-                                    duration=duration)
-        
-        # Resize the emotion clip using CHARACTER_AVERAGE_SIZE
-        emotion_clip = emotion_clip.resized(VideoMaker.CHARACTER_AVERAGE_SIZE)
-        
-        # Calculate the height of the emotion clip by dividing its height by 1.4
-        emotion_height = int(emotion_clip.h // 1.4) - 50
-        
-        # Resize the emotion clip to the calculated height and set its position
-        video_width, video_height = self.clips[0].w, self.clips[0].h
-        character_width = emotion_clip.w
-        left_margin = video_width - character_width - 100  # 100 pixels from the right edge
-        emotion_clip = emotion_clip.resized(height=emotion_height)\
-            .with_position("bottom", "right")\
-            .with_effects([vfx.Margin(bottom=10, left=left_margin, opacity=0)])
-        
-        # Set the start time of the clip to the current time of the video.
-        emotion_clip = emotion_clip.with_start(self.current_time)
-        
-        # Add the emotion clip to the list of clips.
-        self.clips.append(emotion_clip)
-        
-        # Update the current time of the video by adding the duration of the emotion clip.
-        self.current_time += duration
-        
-        # Return the updated current time of the video.
-        return self.current_time
-
-    async def add_espeech_clip(self, emotion_name: str, text: str, duration: float = None) -> float:
-        """
-        Adds an emotion clip with text-to-speech to the video.
-
-        Args:
-            emotion_name (str): The name of the emotion to add.
-            text (str): The text to convert to speech.
-            duration (float, optional): The duration of the clip. If not provided, the duration of the text-to-speech clip will be used.
-
-        Returns:
-            float: The updated current time of the video.
-        """
-        tts_clip, tts_duration = await VideoMaker.edge_tts_to_clip(text, self.current_time, duration)
-        
-        # If a duration is not provided, use the duration of the text-to-speech clip.
-        emotion_duration = duration if duration else tts_duration
-        
-        # Ensure the emotion clip is created with the correct duration
-        emotion_clip = CharacterClip(emotion_name, VideoMaker.CHARACTERS, VideoMaker.CHAR_DIR, duration=emotion_duration)
-        emotion_clip = emotion_clip.resized(VideoMaker.CHARACTER_AVERAGE_SIZE)
-        
-        # Calculate the height of the emotion clip by dividing its height by 1.4.
-        emotion_height = int(emotion_clip.h // 1.4) - 50
-        
-        # Resize the emotion clip to the calculated height and set its position to the bottom right of the video.
-        # Also apply margins to the emotion clip to position it correctly.
-        video_width, video_height = self.clips[0].w, self.clips[0].h
-        character_width = emotion_clip.w
-        left_margin = video_width - character_width - 100  # 100 pixels from the right edge
-        emotion_clip = emotion_clip.resized(height=emotion_height)\
-            .with_position("bottom", "right")\
-            .with_effects([vfx.Margin(bottom=10, left=left_margin, opacity=0)])
-        
-        # Set the start time of the emotion clip to the current time of the video.
-        emotion_clip = emotion_clip.with_start(self.current_time)
-        
-        # Add the emotion clip and the text-to-speech clip to the list of clips.
-        self.clips.append(emotion_clip)
-        self.clips.append(tts_clip)
-        
-        # Update the current time of the video by adding the duration of the emotion clip.
-        self.current_time += emotion_duration
-        
-        # Return the updated current time of the video.
-        return self.current_time
-
-    async def add_textspeech_clip(self, text: str, duration: float = None, bg_clip: VideoClip = None) -> float:
-        """Adds a text-to-speech clip with dynamic text wrapping."""
-        try:
-            tts_clip, tts_duration = await VideoMaker.edge_tts_to_clip(text, self.current_time, duration)
-
-            img = Image.fromarray(np.array(bg_clip.get_frame(0)).astype('uint8'))
-            draw = ImageDraw.Draw(img)
-            font = ImageFont.truetype(self.current_font, 70)  # Keep font size consistent
-
-            # Calculate available width for text (with margins)
-            margin = 50  # Adjust margin as needed
-            max_width = VideoMaker.RESOLUTION[0] - 2 * margin
-
-            # Wrap the text
-            wrapped_text = textwrap.fill(text, width=int(max_width / (draw.textbbox((0, 0), "A", font=font)[2]-draw.textbbox((0, 0), "", font=font)[2])))
-
-            # Calculate text position to center it vertically as well
-            lines = wrapped_text.splitlines()
-            total_text_height = sum([draw.textbbox((0, 0), line, font=font)[3] for line in lines])
-            y_text = (VideoMaker.RESOLUTION[1] - total_text_height) / 2
-            x_text = VideoMaker.RESOLUTION[0] / 2
-
-            for line in lines:
-                text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
-                draw.text((x_text-(text_width/2), y_text), line, font=font, fill='black')
-                y_text += text_height
-
-            img_array = np.array(img)
-            text_clip = ImageClip(img_array).with_duration(tts_duration)
-            text_clip: TextClip = text_clip.with_effects([vfx.FadeOut(0.5), vfx.FadeIn(0.5)])
-            text_clip = text_clip.with_start(self.current_time).with_audio(tts_clip.audio)
-            self.clips.append(text_clip)
-            self.current_time += tts_duration
-            return self.current_time
-
-        except Exception as e:
-            logger.error(f"Error adding textspeech clip: {e}")
-            raise
-
-    def add_insert_clip(self, video_path: str) -> float:
-        """
-        Adds a video clip to the list of clips, setting its start time to the current time of the video.
-
-        Args:
-            video_path (str): The path to the video file to be inserted.
-
-        Returns:
-            float: The updated current time of the video, which is the current time plus the duration of the inserted video clip.
-        """
-        # Create a new video clip from the given video file.
-        insert_clip = VideoFileClip(video_path)
-
-        # Set the start time of the inserted video clip to the current time of the video.
-        insert_clip = insert_clip.with_start(self.current_time)
-
-        # Add the inserted video clip to the list of clips.
-        self.clips.append(insert_clip)
-
-        # Update the current time of the video by adding the duration of the inserted video clip.
-        self.current_time += insert_clip.duration
-
-        # Return the updated current time of the video.
-        return self.current_time
-
-    def export_final_video(self, save_path: str, fps: int):
-        try:
-            final_video = CompositeVideoClip(self.clips)
-            final_video.write_videofile(save_path, fps=fps, threads=32, codec='libx264')
-            logger.info(f"Final video '{save_path}' exported at {fps} FPS.")
-        except OSError as e:
-            if "unable to find a suitable output format" in str(e).lower():
-                logger.error("Output format error: Invalid output file type.")
-                exit(1)
-        finally:
-            # Close all clips
-            for clip in self.clips:
-                try:
-                    clip.close()
-                except:
-                    pass
-            try:
-                final_video.close()
-            except:
-                pass
-
-    async def process_script(self):
-        """Process an XML script into a video."""
-        try:
-            tree = ET.parse(self.script_path)
-            root = tree.getroot()
-
-            if root.tag != "video":
-                raise VideoMaker.InvalidScriptError("Root element must be <video>")
-
-            resolution_str = root.get("resolution", "1920x1080")  # Default resolution
-            try:
-                VideoMaker.RESOLUTION = tuple(map(int, resolution_str.split("x")))
-            except ValueError:
-                raise VideoMaker.InvalidScriptError("Invalid resolution format (e.g., 1920x1080)")
-
-            bg_clip = utils.WhiteClip(VideoMaker.RESOLUTION).with_duration(0) # Initial background clip
-            self.clips.append(bg_clip)
-            max_end_time = 0
-
-            for element in root:
-                if element.tag == "emotion":
-                    name = element.get("name")
-                    duration = float(element.get("duration"))
-                    self.add_emotion_clip(name, duration)
-                    max_end_time = max(max_end_time, self.current_time)
-
-                elif element.tag == "espeech":
-                    emotion = element.get("emotion")
-                    duration_str = element.get("duration", "auto")
-                    duration = float(duration_str) if duration_str != "auto" else None
-                    text = element.text.strip()
-                    await self.add_espeech_clip(emotion, text, duration)
-                    max_end_time = max(max_end_time, self.current_time)
-
-                elif element.tag == "insert":
-                    path = element.get("path")
-                    self.add_insert_clip(path)
-                    max_end_time = max(max_end_time, self.current_time)
-
-                elif element.tag == "textspeech":
-                    duration_str = element.get("duration", "auto")
-                    duration = float(duration_str) if duration_str != "auto" else None
-                    text = element.text.strip()
-                    await self.add_textspeech_clip(text, duration, bg_clip)
-                    max_end_time = max(max_end_time, self.current_time)
-
-                elif element.tag == "end":
-                    output_path = element.get("output", "output.mp4") # Default output
-                    fps = int(element.get("fps", 24)) # Default FPS
-                    self.clips[0] = self.clips[0].with_duration(max_end_time)
-                    self.export_final_video(output_path, fps)
-                    return # Exit after exporting
-                elif element.tag == "background":
-                    color = element.get("color", "white")
-                    rgb_color = self.get_rgb_color(color)
-                    bg_clip = utils.ColorClip(VideoMaker.RESOLUTION, rgb_color).with_duration(0)
-                    self.clips[0] = bg_clip
-                elif element.tag == "start":
-                    pass
-                else:
-                    logger.warning(f"Unknown element: {element.tag}")
-            self.clips[0] = self.clips[0].with_duration(max_end_time)
-            self.export_final_video("output.mp4", 24)
-
-        except ET.ParseError as e:
-            raise VideoMaker.InvalidScriptError(f"XML parsing error: {e}")
-        except FileNotFoundError:
-            raise VideoMaker.InvalidScriptError(f"Script file not found: {self.script_path}")
-        except ValueError as e: # Handle invalid float conversions
-            raise VideoMaker.InvalidScriptError(f"Invalid value in script: {e}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            raise
-
-    @staticmethod
-    def get_rgb_color(color_name: str) -> tuple:
-        def convert_to_rgb(color: str):
-            color = color.lstrip('#')
-            r = int(color[:2], 16)
-            g = int(color[2:4], 16)
-            b = int(color[4:6], 16)
-            return (r, g, b)
-
-        if color_name.lower().startswith("#"): return convert_to_rgb(color_name)
-
-        colors = {
-            "black": (0, 0, 0),
-            "white": (255, 255, 255),
-            "red": (255, 0, 0),
-            "green": (0, 255, 0),
-            "blue": (0, 0, 255),
-            "yellow": (255, 255, 0),
-            "cyan": (0, 255, 255),
-            "magenta": (255, 0, 255),
-            "lightgrey": (200, 200, 200),
-        }
-        return colors.get(color_name.lower(), (255, 255, 255))  # Default to white if color not found
-
-    class InvalidScriptError(Exception):
-        """Custom exception for invalid script format."""
-        pass
-
-def main() -> None:
-    """
-    Generate a video based on a script.
-
-    Args:
-        script_path (str): Path to the script file.
-        output_path (Optional[str], optional): Path to save the final video.
-            If not provided, it will use the path in the [END] tag. Defaults to None.
-    """
-    parser = argparse.ArgumentParser(description="Generate videos based on a script.")
-    parser.add_argument("script_path", type=str, help="Path to the script file.")
-    parser.add_argument("-o", "--output_path", type=str, help="Optional path to save the final video. If not provided, it will use the path in the [END] tag.")
-
-    args = parser.parse_args()
-
-    # Create a VideoMaker instance.
-    video_maker = VideoMaker(args.script_path, args.output_path)
-
-    # Process the script asynchronously
-    asyncio.run(video_maker.process_script())  # Use asyncio.run to await the coroutine
-
-if __name__ == '__main__':
-    main()
+#!/usr/bin/env python3
+
+import argparse
+import tempfile
+import os
+import logging
+import sys
+import numpy as np
+import re
+import asyncio  # Add this import at the top of your file
+import functools
+import textwrap  # Import the textwrap module
+import xml.etree.ElementTree as ET
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import utils
+
+from os.path import abspath, dirname
+from typing import Iterable, Iterator, List, Tuple, Optional, NamedTuple
+
+from PIL import Image, ImageDraw, ImageFont
+from loguru import logger
+
+# Settings of the video, read from the <video> and <end> tags.
+class ScriptHeader(NamedTuple):
+    resolution: Tuple[int, int]
+    output_path: str
+    fps: int
+
+# Commands of the timeline, one per script element.
+class EmotionCommand(NamedTuple):
+    name: str
+    duration: float
+
+class ESpeechCommand(NamedTuple):
+    emotion: str
+    text: str
+    duration: Optional[float]
+
+class InsertCommand(NamedTuple):
+    path: str
+
+class TextSpeechCommand(NamedTuple):
+    text: str
+    duration: Optional[float]
+
+class BackgroundCommand(NamedTuple):
+    color: tuple
+
+# The star of the show: VideoMaker class.
+class VideoMaker:
+    ROOT_DIR = abspath(dirname(__file__))
+    CHAR_DIR = os.path.join(ROOT_DIR, "character")  # Correct usage of os.path.join
+    STATICS_DIR = os.path.join(ROOT_DIR, "statics")  # Correct usage of os.path.join
+
+    # Default resolution, used until the script sets its own
+    RESOLUTION = (1920, 1080)
+    TTS_VOICE = "en-US-AndrewMultilingualNeural"
+    # Available TTS engines and the audio format each one writes.
+    TTS_ENGINES = {"edge": ".mp3", "local": ".wav"}
+    # Maximum number of TTS requests in flight at the same time.
+    TTS_CONCURRENCY = 8
+    # Font size of the text shown by <textspeech>
+    TEXT_FONT_SIZE = 70
+    ENCODERS = ("auto", "cpu", *utils.HARDWARE_ENCODERS)
+    # Segments encoded at the same time on a hardware encoder, consumer NVENC drivers allow only a few sessions
+    HARDWARE_ENCODER_SESSIONS = 2
+
+    def __init__(self, script_path: str, output_path: Optional[str] = None, tts_engine: str = "edge",
+                 tts_cache: bool = True, preset: str = utils.SEGMENT_PRESET, crf: int = utils.SEGMENT_CRF,
+                 encoder: str = "auto") -> None:
+        """
+        Initialize VideoMaker instance.
+
+        Args:
+            script_path (str): Path to the script file.
+            output_path (Optional[str], optional): Path to save the final video.
+                If not provided, it will use the path in the [END] tag. Defaults to None.
+            tts_engine (str, optional): TTS engine to use, "edge" (online) or
+                "local" (offline, pyttsx3). Defaults to "edge".
+            tts_cache (bool, optional): Reuse speech synthesized by previous runs,
+                stored in utils.TTS_CACHE_DIR. Defaults to True.
+            preset (str, optional): x264 preset of the encode, "ultrafast" for drafts,
+                "veryfast" or slower for final renders. Defaults to "ultrafast".
+            crf (int, optional): x264 constant rate factor, lower is better quality. Defaults to 23.
+            encoder (str, optional): Video encoder, "cpu" (libx264), a hardware encoder
+                of utils.HARDWARE_ENCODERS, or "auto" for the first working hardware
+                encoder, falling back to libx264. Defaults to "auto".
+        """
+        if tts_engine not in VideoMaker.TTS_ENGINES:
+            raise ValueError(f"Unknown TTS engine '{tts_engine}', expected one of {tuple(VideoMaker.TTS_ENGINES)}")
+        if encoder not in VideoMaker.ENCODERS:
+            raise ValueError(f"Unknown encoder '{encoder}', expected one of {VideoMaker.ENCODERS}")
+        self.script_path = script_path
+        self.output_path = output_path
+        self.tts_engine = tts_engine
+        self.tts_cache = tts_cache
+        self.preset = preset
+        self.crf = crf
+        self.encoder = encoder
+        # Synthesized (audio file, duration) pairs, keyed by the text they contain.
+        self.speech_files = {}
+        # Shared by every edge TTS request of the run, long lines send several
+        self.tts_requests = asyncio.Semaphore(VideoMaker.TTS_CONCURRENCY)
+        # Speech lines found in the TTS cache instead of synthesized
+        self.tts_cache_hits = 0
+        # Initialize the current font
+        self.current_font = VideoMaker.default_font()
+        # Parse the font once, and reuse a single canvas for every text frame
+        self.text_font = ImageFont.truetype(self.current_font, VideoMaker.TEXT_FONT_SIZE)
+        self._text_canvas = None
+        self.background_color = (255, 255, 255)
+        # Segments to render, in timeline order
+        self.segment_specs = []
+        self.work_dir = None
+        self.scratch_dir = None
+        # Frames of the sprites composed over the background, keyed by (emotion, background color)
+        self._still_frames = {}
+        # Text frames, keyed by (text, background color)
+        self._text_frames = {}
+        self.resolution = VideoMaker.RESOLUTION
+        self.fps = 24
+        self.current_time = 0
+
+    async def synthesize_speech(self, text: str) -> Tuple[str, float]:
+        """
+        Convert text to speech with the selected TTS engine.
+
+        Args:
+            text (str): Text to convert to speech.
+
+        Returns:
+            Tuple[str, float]: Path to the audio file and its duration.
+        """
+        suffix = VideoMaker.TTS_ENGINES[self.tts_engine]
+        cache_key = utils.tts_cache_key(text, VideoMaker.TTS_VOICE, self.tts_engine)
+        if self.tts_cache:
+            cached = utils.tts_cache_lookup(cache_key, suffix)
+            if cached is not None:
+                self.tts_cache_hits += 1
+                return cached
+
+        # Uncached speech lives in the run's scratch directory and is removed with it
+        fd, audio_path = tempfile.mkstemp(dir=self.scratch_dir.name, prefix="speech_", suffix=suffix)
+        os.close(fd)
+
+        if self.tts_engine == "local":
+            # pyttsx3 is blocking and bound to one thread, run it on the dedicated one
+            await asyncio.get_running_loop().run_in_executor(utils.LOCAL_TTS_EXECUTOR, utils.local_tts_to_audiofile,
+                                                             text, audio_path)
+        else:
+            await utils.edge_tts_to_audiofile(text, VideoMaker.TTS_VOICE, audio_path, self.tts_requests)
+
+        # Probing and copying block, other lines keep downloading meanwhile
+        duration = await asyncio.to_thread(utils.probe_audio_duration, audio_path)
+        if self.tts_cache:
+            try:
+                audio_path = await asyncio.to_thread(utils.tts_cache_store, cache_key, suffix, audio_path, duration)
+            except OSError as e:
+                # The cache is only an optimization, the synthesized file is still there
+                logger.warning(f"Could not store speech in the TTS cache: {e}")
+        return audio_path, duration
+
+    def speech_scratch_dir(self) -> tempfile.TemporaryDirectory:
+        """
+        Create the directory new speech is synthesized into, removed after the run.
+        With the TTS cache on it is inside the cache directory, so storing a line
+        is a hard link on the same filesystem. Without it, uncached speech is
+        small and short-lived and goes to RAM where possible.
+        """
+        if self.tts_cache:
+            try:
+                os.makedirs(utils.TTS_CACHE_DIR, exist_ok=True)
+                return tempfile.TemporaryDirectory(prefix=".open_video_gen_", dir=utils.TTS_CACHE_DIR)
+            except OSError as e:
+                logger.warning(f"Could not use the TTS cache directory: {e}")
+        return tempfile.TemporaryDirectory(prefix="open_video_gen_", dir=utils.SCRATCH_DIR)
+
+    async def prefetch_speech(self, commands: List[tuple]) -> None:
+        """
+        Synthesize every speech line of the script concurrently, before any
+        clip is built, so the network round-trips overlap instead of adding up.
+
+        Args:
+            commands (List[tuple]): The commands of the script.
+        """
+        texts = [command.text for command in commands
+                 if isinstance(command, (ESpeechCommand, TextSpeechCommand)) and command.text]
+        # Identical lines only need to be synthesized once
+        texts = [text for text in dict.fromkeys(texts) if text not in self.speech_files]
+        hits = self.tts_cache_hits
+        # The requests themselves are capped by self.tts_requests, not the lines
+        speeches = await asyncio.gather(*(self.synthesize_speech(text) for text in texts))
+        self.speech_files.update(zip(texts, speeches))
+        hits = self.tts_cache_hits - hits
+        logger.info(f"Synthesized {len(texts) - hits} new speech line(s) with the '{self.tts_engine}' engine, "
+                    f"{hits} from the TTS cache.")
+
+    def prefetch_sprites(self, commands: List[tuple]) -> None:
+        """
+        Decode and resize every sprite the script shows, in a thread pool.
+        OpenCV releases the GIL, so the PNG decodes overlap across cores and
+        with the speech downloads.
+
+        Args:
+            commands (List[tuple]): The commands of the script.
+        """
+        names = [command.name if isinstance(command, EmotionCommand) else command.emotion for command in commands
+                 if isinstance(command, (EmotionCommand, ESpeechCommand))]
+        # Unknown names are left for positioned_sprite to report at their command
+        names = [name for name in dict.fromkeys(names) if name in VideoMaker.sprites()]
+        if not names:
+            return
+        with ThreadPoolExecutor(max_workers=min(len(names), os.cpu_count() or 1)) as executor:
+            list(executor.map(lambda name: VideoMaker.positioned_sprite(name, self.resolution), names))
+
+    async def speech_duration(self, text: str, duration: float = None) -> Tuple[str, float]:
+        """
+        Get the audio file of a speech line and how long it plays for,
+        synthesizing it if prefetch_speech didn't.
+
+        Args:
+            text (str): Text to convert to speech.
+            duration (float, optional): Maximum duration, the speech is trimmed
+                to it when longer. Defaults to None.
+
+        Returns:
+            Tuple[str, float]: A tuple containing the audio path and the
+                duration of the speech.
+        """
+        if text not in self.speech_files:
+            self.speech_files[text] = await self.synthesize_speech(text)
+        audio_path, audio_duration = self.speech_files[text]
+
+        if duration is None or audio_duration <= duration:
+            # If no duration is specified, or the audio is shorter, use the audio duration
+            return audio_path, audio_duration
+        # If the audio duration is longer than the specified duration, trim it
+        return audio_path, duration
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def sprites(cls) -> dict:
+        """Get the sprite paths, by emotion name. The character folder is only listed on first use, not at import."""
+        return utils.load_sprites_recursively(cls.CHAR_DIR)
+
+    @classmethod
+    def characters(cls) -> tuple:
+        """Get the names of the available emotions."""
+        return tuple(cls.sprites())
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def default_font(cls) -> str:
+        """Get the path of the text font. The font manager lookup runs once per process, not per instance."""
+        import matplotlib.font_manager as fm  # Slow to import, only needed once a video is made
+        return fm.findfont(fm.FontProperties(family="Arial"))
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def character_average_size(cls) -> tuple:
+        """Get an estimate of the character size, from the first sprites."""
+        return utils.get_character_average_size(utils.get_character_images(cls.sprites(), cls.CHAR_DIR))
+
+    @classmethod
+    def positioned_sprite(cls, emotion_name: str, resolution: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Get the RGBA pixels of an emotion sprite, resized for a video
+        resolution, and the position of its top left corner in the frame.
+
+        Args:
+            emotion_name (str): The name of the emotion.
+            resolution (Tuple[int, int]): (width, height) of the video.
+
+        Returns:
+            tuple: The sprite pixels and their (x, y) position.
+        """
+        if emotion_name not in cls.sprites():
+            raise ValueError(f"Character '{emotion_name}' not in {cls.characters()}")
+        return cls._load_positioned_sprite(emotion_name, resolution)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _load_positioned_sprite(cls, emotion_name: str, resolution: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int]]:
+        # Decoded on first use only, so a script pays for the sprites it shows
+        return utils.build_positioned_sprite(cls.sprites()[emotion_name], cls.character_average_size(), resolution)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def background_frame(color: Tuple[int, int, int], resolution: Tuple[int, int]) -> np.ndarray:
+        """
+        Get a read-only RGB frame filled with a background color, allocated
+        once for every color and resolution and shared by all the frames built on it.
+
+        Args:
+            color (tuple): The RGB background color.
+            resolution (tuple): (width, height) of the frame.
+
+        Returns:
+            np.ndarray: Contiguous uint8 array of shape (height, width, 3).
+        """
+        frame = np.empty((resolution[1], resolution[0], 3), dtype=np.uint8)
+        frame[...] = color
+        frame.flags.writeable = False
+        return frame
+
+    def composed_frame(self, emotion_name: str) -> np.ndarray:
+        """
+        Get the RGB frame of the emotion sprite blended over the current background.
+        Only the pixels under the sprite are blended, the rest is a block copy of
+        the background frame. The frame isn't kept, still_frame writes it once.
+
+        Args:
+            emotion_name (str): The name of the emotion.
+
+        Returns:
+            np.ndarray: The composed frame.
+        """
+        sprite, (x, y) = VideoMaker.positioned_sprite(emotion_name, self.resolution)
+        frame = VideoMaker.background_frame(self.background_color, self.resolution).copy()
+        region = frame[y:y + sprite.shape[0], x:x + sprite.shape[1]]
+        region[...] = utils.alpha_blend(region, sprite)
+        return frame
+
+    def still_frame(self, emotion_name: str) -> str:
+        """
+        Get the path of an image of the emotion sprite composed over the current
+        background, written once per run for every emotion and background color.
+
+        Args:
+            emotion_name (str): The name of the emotion.
+
+        Returns:
+            str: Path to the composed frame.
+        """
+        key = (emotion_name, self.background_color)
+        if key not in self._still_frames:
+            frame_path = os.path.join(self.work_dir.name, f"frame_{len(self._still_frames):04d}.png")
+            Image.fromarray(self.composed_frame(emotion_name)).save(frame_path, compress_level=1)
+            self._still_frames[key] = frame_path
+        return self._still_frames[key]
+
+    def _queue_segment(self, spec: dict) -> float:
+        """
+        Appends a segment to the timeline. Segments are only described here, as
+        picklable specs for utils.render_segment, and rendered in parallel on export.
+
+        Args:
+            spec (dict): The segment spec, with its "kind" and "duration".
+
+        Returns:
+            float: The updated current time of the video.
+        """
+        self.current_time += spec["duration"]
+        previous = self.segment_specs[-1] if self.segment_specs else None
+        if (previous is not None and previous["kind"] == spec["kind"] == "still"
+                and previous["image_path"] == spec["image_path"]
+                and previous["audio_path"] is None and spec["audio_path"] is None):
+            # The same silent frame again only extends the previous segment
+            previous["duration"] += spec["duration"]
+            return self.current_time
+
+        spec["output_path"] = os.path.join(self.work_dir.name, f"segment_{len(self.segment_specs):04d}.mp4")
+        spec["fps"] = self.fps
+        self.segment_specs.append(spec)
+        return self.current_time
+
+    def add_emotion_clip(self, emotion_name: str, duration: float) -> float:
+        """
+        Adds an emotion clip to the video.
+
+        Args:
+            emotion_name (str): The name of the emotion to add.
+            duration (float): The duration of the clip.
+
+        Returns:
+            float: The updated current time of the video.
+        """
+        # Show the sprite over the background as a silent still segment.
+        return self._queue_segment({"kind": "still", "image_path": self.still_frame(emotion_name),
+                                    "audio_path": None, "duration": duration})
+
+    async def add_espeech_clip(self, emotion_name: str, text: str, duration: float = None) -> float:
+        """
+        Adds an emotion clip with text-to-speech to the video.
+
+        Args:
+            emotion_name (str): The name of the emotion to add.
+            text (str): The text to convert to speech.
+            duration (float, optional): The duration of the clip. If not provided, the duration of the text-to-speech clip will be used.
+
+        Returns:
+            float: The updated current time of the video.
+        """
+        audio_path, tts_duration = await self.speech_duration(text, duration)
+        
+        # If a duration is not provided, use the duration of the text-to-speech clip.
+        emotion_duration = duration if duration else tts_duration
+        
+        # Show the sprite over the background with the speech, ffmpeg trims or pads the audio.
+        return self._queue_segment({"kind": "still", "image_path": self.still_frame(emotion_name),
+                                    "audio_path": audio_path, "duration": emotion_duration})
+
+    def clear_text_canvas(self) -> Image.Image:
+        """Fill the reusable text canvas with the background color and return it."""
+        if self._text_canvas is None or self._text_canvas.size != self.resolution:
+            self._text_canvas = Image.new("RGB", self.resolution)
+        self._text_canvas.paste(self.background_color, (0, 0, *self.resolution))
+        return self._text_canvas
+
+    def text_frame(self, text: str) -> str:
+        """
+        Get the path of an image of the text, wrapped and centered over the
+        current background, drawn once per run for every text and background color.
+
+        Args:
+            text (str): The text to draw.
+
+        Returns:
+            str: Path to the text frame.
+        """
+        key = (text, self.background_color)
+        if key in self._text_frames:
+            return self._text_frames[key]
+
+        img = self.clear_text_canvas()
+        draw = ImageDraw.Draw(img)
+        font = self.text_font
+
+        # Calculate available width for text (with margins)
+        margin = 50  # Adjust margin as needed
+        max_width = self.resolution[0] - 2 * margin
+
+        # Wrap the text, using the advance width of "A" as the character width
+        chars_per_line = max(1, int(max_width / font.getlength("A")))
+        wrapped_text = "\n".join(textwrap.wrap(text, width=chars_per_line))
+
+        # Center the whole block, Pillow lays out the lines itself
+        left, top, right, bottom = draw.multiline_textbbox((0, 0), wrapped_text, font=font, align="center")
+        x_text = (self.resolution[0] - (right - left)) / 2 - left
+        y_text = (self.resolution[1] - (bottom - top)) / 2 - top
+        draw.multiline_text((x_text, y_text), wrapped_text, font=font, fill='black', align="center")
+
+        # The canvas is reused, write it out now rather than keeping a copy of every frame
+        frame_path = os.path.join(self.work_dir.name, f"text_{len(self._text_frames):04d}.png")
+        img.save(frame_path, compress_level=1)
+        self._text_frames[key] = frame_path
+        return frame_path
+
+    async def add_textspeech_clip(self, text: str, duration: float = None) -> float:
+        """Adds a text-to-speech clip with dynamic text wrapping."""
+        try:
+            audio_path, tts_duration = await self.speech_duration(text, duration)
+
+            frame_path = self.text_frame(text)
+            return self._queue_segment({"kind": "text", "image_path": frame_path,
+                                        "audio_path": audio_path, "duration": tts_duration})
+
+        except Exception as e:
+            logger.error(f"Error adding textspeech clip: {e}")
+            raise
+
+    def add_insert_clip(self, video_path: str) -> float:
+        """
+        Adds a video clip to the video, over the background, at the current time of the video.
+
+        Args:
+            video_path (str): The path to the video file to be inserted.
+
+        Returns:
+            float: The updated current time of the video, which is the current time plus the duration of the inserted video clip.
+        """
+        # Probe the video file for the timeline, without opening a frame reader.
+        infos = utils.probe_video(video_path)
+
+        # Place the inserted video over the background, at full resolution.
+        return self._queue_segment({"kind": "insert", "video_path": video_path, "resolution": self.resolution,
+                                    "background_color": self.background_color, "duration": infos["duration"],
+                                    "has_audio": infos["has_audio"]})
+
+    def resolve_encoder(self) -> str:
+        """Get the name of the video encoder to use, "cpu" when no requested hardware encoder works."""
+        if self.encoder == "auto":
+            return utils.detect_hardware_encoder() or "cpu"
+        if self.encoder != "cpu" and not utils.hardware_encoder_available(self.encoder):
+            logger.warning(f"Encoder '{self.encoder}' is not available on this machine, using libx264.")
+            return "cpu"
+        return self.encoder
+
+    @staticmethod
+    def segment_key(spec: dict) -> tuple:
+        """Identify the content of a segment spec, everything but the file it is rendered to."""
+        return tuple(sorted((key, value) for key, value in spec.items() if key != "output_path"))
+
+    def render_segments(self, unique_specs: dict, encoder_name: str) -> dict:
+        """
+        Render segment specs in parallel with one encoder. libx264 gets one
+        process per CPU core, hardware encoders at most HARDWARE_ENCODER_SESSIONS,
+        as drivers limit the encoding sessions open at once.
+
+        Args:
+            unique_specs (dict): Segment specs, by segment key.
+            encoder_name (str): "cpu" or a key of utils.HARDWARE_ENCODERS.
+
+        Returns:
+            dict: The rendered segment paths, by segment key.
+        """
+        cpus = os.cpu_count() or 1
+        workers = max(1, min(cpus, len(unique_specs)))
+        if encoder_name in utils.HARDWARE_ENCODERS:
+            workers = min(workers, VideoMaker.HARDWARE_ENCODER_SESSIONS)
+        # Split the cores between the workers instead of letting every encoder use all of them
+        encoder = {"name": encoder_name, "preset": self.preset, "crf": self.crf,
+                   "threads": max(1, cpus // workers)}
+        settings = f"preset {self.preset}, CRF {self.crf}" if encoder_name == "cpu" else f"{encoder_name} encoder"
+        logger.info(f"Rendering {len(unique_specs)} segment(s) on {workers} process(es), {settings}.")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(unique_specs, executor.map(functools.partial(utils.render_segment, encoder=encoder),
+                                                       unique_specs.values())))
+
+    @staticmethod
+    def check_output_path(save_path: str) -> None:
+        """
+        Exit with an error if the video can't be saved to a path, checked before
+        anything is rendered since ffmpeg only opens the output once every segment is done.
+
+        Args:
+            save_path (str): Path to save the final video.
+        """
+        if not save_path.lower().endswith(utils.OUTPUT_EXTENSIONS):
+            logger.error(f"Output format error: Invalid output file type, use one of {', '.join(utils.OUTPUT_EXTENSIONS)}.")
+            exit(1)
+        output_dir = os.path.dirname(os.path.abspath(save_path))
+        if not os.path.isdir(output_dir):
+            logger.error(f"Output directory '{output_dir}' does not exist.")
+            exit(1)
+
+    def export_final_video(self, save_path: str, fps: int):
+        """
+        Renders the queued segments in parallel with render_segments, then
+        concatenates them into the final video. Every segment is encoded with the
+        same encoder settings, so the streams are copied, not re-encoded.
+
+        Args:
+            save_path (str): Path to save the final video, checked by check_output_path.
+            fps (int): Frame rate of the segments.
+        """
+        # Identical segments, e.g. an insert or a caption used twice, are rendered once
+        keys = [VideoMaker.segment_key(spec) for spec in self.segment_specs]
+        unique_specs = dict(zip(keys, self.segment_specs))
+
+        encoder_name = self.resolve_encoder()
+        try:
+            rendered = self.render_segments(unique_specs, encoder_name)
+        except OSError as e:
+            if encoder_name == "cpu":
+                raise
+            # Segments are concatenated without re-encoding, so they must all come from the same encoder
+            logger.warning(f"The {encoder_name} encoder failed ({e}), rendering every segment again with libx264.")
+            rendered = self.render_segments(unique_specs, "cpu")
+        # The concat list can name the same segment file several times
+        segments = [rendered[key] for key in keys]
+        utils.concat_segments(segments, os.path.join(self.work_dir.name, "concat.txt"), save_path)
+        logger.info(f"Final video '{save_path}' exported at {fps} FPS.")
+
+    @staticmethod
+    def parse_duration(element: ET.Element) -> Optional[float]:
+        """Parse the duration attribute of an element, None for "auto" (the default)."""
+        duration_str = element.get("duration", "auto")
+        return float(duration_str) if duration_str != "auto" else None
+
+    @staticmethod
+    def iter_script(script_path: str) -> Tuple[ET.Element, Iterator[ET.Element]]:
+        """
+        Stream the elements of a script file with ET.iterparse instead of
+        building its whole tree, so memory does not grow with the script.
+
+        Args:
+            script_path (str): Path to the script file.
+
+        Returns:
+            Tuple[ET.Element, Iterator[ET.Element]]: The root element, with its
+                attributes, and an iterator of its children. Each child is complete
+                when yielded, and dropped from the tree once the next one is requested.
+        """
+        events = ET.iterparse(script_path, events=("start", "end"))
+        _, root = next(events)
+
+        def children() -> Iterator[ET.Element]:
+            depth = 0
+            for event, element in events:
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 0:
+                    yield element
+                    root.remove(element)
+
+        return root, children()
+
+    @staticmethod
+    def parse_script(root: ET.Element, elements: Optional[Iterable[ET.Element]] = None) -> Tuple[ScriptHeader, List[tuple]]:
+        """
+        Parse a whole script before anything is rendered.
+
+        Args:
+            root (ET.Element): Root <video> element of the script.
+            elements (Optional[Iterable[ET.Element]], optional): Children of the root,
+                e.g. streamed by iter_script. Defaults to the children of root.
+
+        Returns:
+            Tuple[ScriptHeader, List[tuple]]: The video settings, and the
+                commands of the timeline in order.
+        """
+        if root.tag != "video":
+            raise VideoMaker.InvalidScriptError("Root element must be <video>")
+
+        resolution_str = root.get("resolution", "1920x1080")  # Default resolution
+        try:
+            resolution = tuple(map(int, resolution_str.split("x")))
+        except ValueError:
+            raise VideoMaker.InvalidScriptError("Invalid resolution format (e.g., 1920x1080)")
+
+        parsers = {
+            "emotion": lambda e: EmotionCommand(e.get("name"), float(e.get("duration"))),
+            "espeech": lambda e: ESpeechCommand(e.get("emotion"), (e.text or "").strip(), VideoMaker.parse_duration(e)),
+            "insert": lambda e: InsertCommand(e.get("path")),
+            "textspeech": lambda e: TextSpeechCommand((e.text or "").strip(), VideoMaker.parse_duration(e)),
+            "background": lambda e: BackgroundCommand(VideoMaker.get_rgb_color(e.get("color", "white"))),
+            "start": lambda e: None,
+        }
+
+        output_path, fps = "output.mp4", 24 # Default output and FPS
+        end_seen = False
+        commands = []
+        for element in root if elements is None else elements:
+            if element.tag == "end":
+                if not end_seen:
+                    output_path = element.get("output", output_path)
+                    fps = int(element.get("fps", fps))
+                end_seen = True
+                continue
+            parser = parsers.get(element.tag)
+            if parser is None:
+                logger.warning(f"Unknown element: {element.tag}")
+                continue
+            if end_seen:
+                logger.warning(f"<{element.tag}> after <end>, it is still part of the video")
+            command = parser(element)
+            if command is not None:
+                commands.append(command)
+
+        return ScriptHeader(resolution, output_path, fps), commands
+
+    # Command handlers, dispatched by command type from process_script.
+    async def _handle_emotion(self, command: EmotionCommand) -> None:
+        self.add_emotion_clip(command.name, command.duration)
+
+    async def _handle_espeech(self, command: ESpeechCommand) -> None:
+        await self.add_espeech_clip(command.emotion, command.text, command.duration)
+
+    async def _handle_insert(self, command: InsertCommand) -> None:
+        self.add_insert_clip(command.path)
+
+    async def _handle_textspeech(self, command: TextSpeechCommand) -> None:
+        await self.add_textspeech_clip(command.text, command.duration)
+
+    async def _handle_background(self, command: BackgroundCommand) -> None:
+        self.background_color = command.color
+
+    async def process_script(self):
+        """Process an XML script into a video."""
+        try:
+            header, commands = VideoMaker.parse_script(*VideoMaker.iter_script(self.script_path))
+            self.resolution = header.resolution
+            self.fps = header.fps
+            # The command line output path takes precedence over the <end> tag
+            output_path = self.output_path or header.output_path
+            # Fail before any speech is synthesized
+            VideoMaker.check_output_path(output_path)
+
+            # Frames and segments of this run, removed once the video is exported
+            self.work_dir = tempfile.TemporaryDirectory(prefix="open_video_gen_")
+            self.scratch_dir = self.speech_scratch_dir()
+            try:
+                # Synthesize all speech and decode the sprites up front, the timeline below only reads the results
+                await asyncio.gather(self.prefetch_speech(commands),
+                                     asyncio.to_thread(self.prefetch_sprites, commands))
+
+                handlers = {
+                    EmotionCommand: self._handle_emotion,
+                    ESpeechCommand: self._handle_espeech,
+                    InsertCommand: self._handle_insert,
+                    TextSpeechCommand: self._handle_textspeech,
+                    BackgroundCommand: self._handle_background,
+                }
+                for command in commands:
+                    await handlers[type(command)](command)
+                # Every frame is on disk by now, free the canvas before the workers start
+                self._text_canvas = None
+                self.export_final_video(output_path, self.fps)
+            finally:
+                self.scratch_dir.cleanup()
+                self.work_dir.cleanup()
+
+        except ET.ParseError as e:
+            raise VideoMaker.InvalidScriptError(f"XML parsing error: {e}")
+        except FileNotFoundError as e:
+            if e.filename != self.script_path:
+                raise
+            raise VideoMaker.InvalidScriptError(f"Script file not found: {self.script_path}")
+        except ValueError as e: # Handle invalid float conversions
+            raise VideoMaker.InvalidScriptError(f"Invalid value in script: {e}")
+        except Exception as e:
+            logger.error(f"An unexpected error occurred: {e}")
+            raise
+
+    @staticmethod
+    def get_rgb_color(color_name: str) -> tuple:
+        def convert_to_rgb(color: str):
+            color = color.lstrip('#')
+            r = int(color[:2], 16)
+            g = int(color[2:4], 16)
+            b = int(color[4:6], 16)
+            return (r, g, b)
+
+        if color_name.lower().startswith("#"): return convert_to_rgb(color_name)
+
+        colors = {
+            "black": (0, 0, 0),
+            "white": (255, 255, 255),
+            "red": (255, 0, 0),
+            "green": (0, 255, 0),
+            "blue": (0, 0, 255),
+            "yellow": (255, 255, 0),
+            "cyan": (0, 255, 255),
+            "magenta": (255, 0, 255),
+            "lightgrey": (200, 200, 200),
+        }
+        return colors.get(color_name.lower(), (255, 255, 255))  # Default to white if color not found
+
+    class InvalidScriptError(Exception):
+        """Custom exception for invalid script format."""
+        pass
+
+def crf_value(value: str) -> int:
+    """Parse a --crf value, rejecting it now rather than when ffmpeg runs."""
+    crf = int(value)
+    if not 0 <= crf <= 51:
+        raise argparse.ArgumentTypeError(f"{crf} is not between 0 and 51")
+    return crf
+
+def main() -> None:
+    """
+    Generate a video based on a script.
+
+    Args:
+        script_path (str): Path to the script file.
+        output_path (Optional[str], optional): Path to save the final video.
+            If not provided, it will use the path in the [END] tag. Defaults to None.
+    """
+    parser = argparse.ArgumentParser(description="Generate videos based on a script.")
+    parser.add_argument("script_path", type=str, help="Path to the script file.")
+    parser.add_argument("-o", "--output_path", type=str, help="Optional path to save the final video. If not provided, it will use the path in the [END] tag.")
+    parser.add_argument("--tts-engine", type=str, choices=tuple(VideoMaker.TTS_ENGINES), default="edge", help="TTS engine: 'edge' (online, default) or 'local' (offline, requires pyttsx3).")
+
+    parser.add_argument("--no-tts-cache", action="store_true", help="Synthesize every speech line again instead of reusing the TTS cache.")
+    parser.add_argument("--preset", type=str, choices=utils.X264_PRESETS, default=utils.SEGMENT_PRESET, help="x264 preset: 'ultrafast' (default) for drafts, 'veryfast' or slower for final renders.")
+    parser.add_argument("--encoder", type=str, choices=VideoMaker.ENCODERS, default="auto", help="Video encoder: 'auto' (default) for the first working hardware encoder, 'cpu' for libx264, or 'nvenc', 'qsv', 'vt'.")
+    parser.add_argument("--crf", type=crf_value, metavar="0-51", default=utils.SEGMENT_CRF, help="x264 constant rate factor, 0-51, lower is better quality. Defaults to 23.")
+
+    args = parser.parse_args()
+
+    # Create a VideoMaker instance.
+    video_maker = VideoMaker(args.script_path, args.output_path, args.tts_engine, tts_cache=not args.no_tts_cache,
+                             preset=args.preset, crf=args.crf, encoder=args.encoder)
+
+    # Process the script asynchronously, on uvloop's faster event loop when it is installed
+    try:
+        import uvloop  # Optional dependency
+    except ImportError:
+        asyncio.run(video_maker.process_script())  # Use asyncio.run to await the coroutine
+    else:
+        uvloop.run(video_maker.process_script())
+
+if __name__ == '__main__':
+    main()
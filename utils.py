@@ -1,56 +1,381 @@
-from moviepy import *
+# moviepy and cv2 are imported by the functions that use them, so that
+# importing this module, e.g. for `main.py --help`, stays fast.
 from PIL import Image
+import numpy as np
 import os
-import edge_tts
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import subprocess
+import shutil
+import functools
+import asyncio
+import contextlib
+import re
+
+# Encoding settings shared by every segment, so they can be concatenated without re-encoding.
+SEGMENT_PRESET = "ultrafast"
+SEGMENT_CRF = 23
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow", "placebo")
+SEGMENT_AUDIO_FPS = 44100
+# Containers the H.264/AAC segments can be copied into as they are.
+OUTPUT_EXTENSIONS = (".mp4", ".m4v", ".mov", ".mkv")
+
+# Hardware H.264 encoders, by --encoder name: the ffmpeg codec and its rate control
+# arguments, where {crf} is the requested constant quality.
+HARDWARE_ENCODERS = {
+    "nvenc": ("h264_nvenc", ["-preset", "p4", "-rc", "vbr", "-cq", "{crf}", "-b:v", "0"]),
+    "qsv": ("h264_qsv", ["-preset", "medium", "-global_quality", "{crf}"]),
+    # Constant quality is not available on every VideoToolbox device, use a bitrate
+    "vt": ("h264_videotoolbox", ["-b:v", "5M"]),
+}
+
+# Persistent cache of synthesized speech, shared across runs.
+TTS_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "open_video_gen")
+
+# Small transient files go to tmpfs on Linux, unless TMPDIR picks another place.
+SCRATCH_DIR = "/dev/shm" if "TMPDIR" not in os.environ and os.access("/dev/shm", os.W_OK) else None
+
+# Longer speech lines are split at sentence ends into requests of about this many characters.
+TTS_CHUNK_CHARS = 400
+
+# pyttsx3 caches a single platform engine (SAPI5, NSSpeechSynthesizer, eSpeak)
+# that must stay on the thread that created it, so local TTS runs on this one thread.
+LOCAL_TTS_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local_tts")
 
 def remove_affix(s: str, affixes: tuple) -> str:
     """Remove prefixes and suffixes from a string."""
-    # Strip whitespace and ensure we handle unexpected characters
-    # print(s)
     for affix in affixes:
-        if s.startswith(affix):
-            s = s[len(affix):]
-        if s.endswith(affix):
-            s = s[:-len(affix)]
+        # An empty affix is a no-op, slicing with -len("") used to empty the string
+        s = s.removeprefix(affix).removesuffix(affix)
     return s
 
 def get_character_images(sprites: dict, character_folder: str):
-    character_images: tuple = tuple()
-    for key in sprites.keys():
-        character_images += (os.path.join(character_folder, f"{key}.png"),)
-    return character_images
+    return tuple(os.path.join(character_folder, f"{key}.png") for key in sprites)
 
 def load_sprites_recursively(char_dir: str):
+    """Map sprite names to their PNG paths. Sprites are only decoded when a clip uses them."""
     sprites: dict = {}
     for sprite_name in os.listdir(char_dir):
         if sprite_name.endswith(".png"):
-            sprites[sprite_name[:-4]] = ImageClip(os.path.join(char_dir, sprite_name))
+            sprites[sprite_name[:-4]] = os.path.join(char_dir, sprite_name)
     return sprites
 
 def get_character_average_size(character_images: tuple) -> tuple[int, int]:
-    return tuple(map(
-        lambda x: int(sum(x) / len(x)),
-        zip(*[Image.open(i).size for i in character_images[:3]])
-    ))
-
-class WhiteClip(ColorClip):
-    def __init__(self, size, *args, **kwargs):
-        super().__init__(size=size, color=(255, 255, 255), *args, **kwargs)
-
-class BlackClip(ColorClip):
-    def __init__(self, size, *args, **kwargs):
-        super().__init__(size=size, color=(0, 0, 0), *args, **kwargs)
-
-class CharacterClip(ImageClip):
-    def __init__(self, character, CHARACTERS: tuple, CHARACTER_IMAGES_FOLDER: str, *args, **kwargs):
-        if character not in CHARACTERS:
-            raise ValueError(f"Character '{character}' not in {CHARACTERS}")
-        super().__init__(os.path.join(CHARACTER_IMAGES_FOLDER, f"{character}.png"), *args, **kwargs)
-        self.character = character
-
-async def edge_tts_to_audiofile(text: str, voice: str, temp_audio_file_path: str) -> str:
-    """Retrieve TTS audio from edge_tts and save to a temporary file."""
-    communicate = edge_tts.Communicate(text, voice)
-    await communicate.save(temp_audio_file_path)
+    sizes = []
+    for character_image in character_images[:3]:
+        # Only the header is read, and the file is closed right away
+        with Image.open(character_image) as image:
+            sizes.append(image.size)
+    return tuple(int(size) for size in np.mean(sizes, axis=0))
+
+def build_positioned_sprite(sprite_path: str, size: tuple, resolution: tuple) -> tuple[np.ndarray, tuple[int, int]]:
+    """
+    Render a character sprite at its on-screen size, cropped to the part of it
+    that falls inside the video frame, so clips can use it without any per-clip transform.
+
+    Args:
+        sprite_path (str): Path to the sprite PNG.
+        size (tuple): Reference (width, height) of the character sprites.
+        resolution (tuple): (width, height) of the video.
+
+    Returns:
+        tuple: RGBA uint8 array of the sprite, and the (x, y) of its top left corner in the frame.
+    """
+    width, height = size
+    video_width, video_height = resolution
+    sprite_height = int(height // 1.4) - 50
+    sprite_width = int(width * sprite_height / height)
+    sprite = resize_rgba(read_rgba(sprite_path), (sprite_width, sprite_height))
+
+    # Bottom right corner, 10 pixels above the bottom edge
+    x = video_width - (width + sprite_width + 100) // 2
+    y = video_height - sprite_height - 10
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = max(min(x + sprite_width, video_width), left), max(min(y + sprite_height, video_height), top)
+    return np.ascontiguousarray(sprite[top - y:bottom - y, left - x:right - x]), (left, top)
+
+def read_rgba(image_path: str) -> np.ndarray:
+    """Read an image file as an RGBA uint8 array, whatever its channels and bit depth."""
+    import cv2 as cv
+    image = cv.imread(image_path, cv.IMREAD_UNCHANGED)
+    if image is None:
+        raise OSError(f"Cannot read image '{image_path}'")
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    conversions = {2: cv.COLOR_GRAY2RGBA, 3: cv.COLOR_BGR2RGBA, 4: cv.COLOR_BGRA2RGBA}
+    channels = 2 if image.ndim == 2 else image.shape[2]
+    return cv.cvtColor(image, conversions[channels])
+
+def resize_rgba(image: np.ndarray, size: tuple) -> np.ndarray:
+    """
+    Resize an RGBA uint8 array with OpenCV's area interpolation, the best
+    filter for shrinking. Colors are resized premultiplied by their alpha so
+    transparent pixels don't bleed into the edges.
+    """
+    import cv2 as cv
+
+    def alpha_factors(rgba):
+        # Scale the colors by the alpha, and the alpha itself by 1
+        alpha = rgba[..., 3]
+        return cv.merge([alpha, alpha, alpha, np.full_like(alpha, 255)])
+
+    premultiplied = cv.multiply(image, alpha_factors(image), scale=1 / 255)
+    resized = cv.resize(premultiplied, size, interpolation=cv.INTER_AREA)
+    # Division by a zero alpha gives 0, fully transparent pixels stay black
+    return cv.divide(resized, alpha_factors(resized), scale=255)
+
+def alpha_blend(background: np.ndarray, sprite: np.ndarray) -> np.ndarray:
+    """
+    Blend an RGBA sprite over an RGB background of the same size, in integer
+    arithmetic on the whole array at once.
+
+    Args:
+        background (np.ndarray): RGB uint8 array, or a color broadcast to the sprite.
+        sprite (np.ndarray): RGBA uint8 array.
+
+    Returns:
+        np.ndarray: The blended RGB uint8 frame.
+    """
+    alpha = sprite[..., 3:4].astype(np.uint16)
+    blended = np.multiply(sprite[..., :3], alpha, dtype=np.uint16)
+    blended += np.multiply(np.asarray(background, dtype=np.uint16), 255 - alpha, dtype=np.uint16)
+    blended += 127  # Round to nearest when dividing
+    blended //= 255
+    return blended.astype(np.uint8)
+
+def split_sentences(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list:
+    """Group the sentences of a text into chunks of at most max_chars, a longer sentence is kept whole."""
+    chunks = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if chunks and len(chunks[-1]) + 1 + len(sentence) <= max_chars:
+            chunks[-1] += " " + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+async def edge_tts_stream(text: str, voice: str, limit: asyncio.Semaphore = None) -> bytes:
+    """Retrieve the MP3 audio of a text from edge_tts, holding the limit, if any, for the request."""
+    import edge_tts  # Imported on first use, it pulls in aiohttp and is not needed offline
+    async with limit if limit is not None else contextlib.nullcontext():
+        communicate = edge_tts.Communicate(text, voice)
+        return b"".join([chunk["data"] async for chunk in communicate.stream() if chunk["type"] == "audio"])
+
+async def edge_tts_to_audiofile(text: str, voice: str, temp_audio_file_path: str,
+                                limit: asyncio.Semaphore = None) -> str:
+    """
+    Retrieve TTS audio from edge_tts and save to a temporary file. The limit
+    caps the requests in flight, it is shared by the sentence groups of a line
+    and, when the caller passes the same one, by other lines.
+    """
+    # Long lines are synthesized sentence groups at a time, concurrently. The
+    # service sends bare MP3 frames, so the parts can simply be joined.
+    parts = await asyncio.gather(*(edge_tts_stream(chunk, voice, limit) for chunk in split_sentences(text)))
+    # Buffer the streamed audio, then write it in one go off the event loop
+    await asyncio.to_thread(write_bytes, temp_audio_file_path, b"".join(parts))
+    return temp_audio_file_path
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as file:
+        file.write(data)
+
+def local_tts_to_audiofile(text: str, temp_audio_file_path: str) -> str:
+    """Synthesize TTS audio offline with pyttsx3 and save it as a WAV file. Only call it on LOCAL_TTS_EXECUTOR."""
+    import pyttsx3  # Optional dependency, only needed for the local engine
+    engine = pyttsx3.init()
+    engine.save_to_file(text, temp_audio_file_path)
+    engine.runAndWait()
     return temp_audio_file_path
+
+def tts_cache_key(text: str, voice: str, engine: str) -> str:
+    """Return the cache key of a speech line."""
+    return hashlib.sha1(f"{text}|{voice}|{engine}".encode("utf-8")).hexdigest()
+
+def tts_cache_lookup(key: str, suffix: str):
+    """Return (audio path, duration) of a cached speech line, or None on a miss."""
+    audio_path = os.path.join(TTS_CACHE_DIR, key + suffix)
+    try:
+        with open(os.path.join(TTS_CACHE_DIR, key + ".json"), "r", encoding="utf-8") as meta_file:
+            duration = json.load(meta_file)["duration"]
+    except (OSError, ValueError, KeyError):
+        return None
+    if not os.path.exists(audio_path):
+        return None
+    return audio_path, duration
+
+def tts_cache_store(key: str, suffix: str, audio_path: str, duration: float) -> str:
+    """
+    Store a synthesized audio file in the cache and return the cached path.
+    The file itself is left in place, so callers can keep using it if the
+    store fails with OSError.
+    """
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    cached_path = os.path.join(TTS_CACHE_DIR, key + suffix)
+    fd, audio_tmp = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=suffix)
+    os.close(fd)
+    meta_tmp = None
+    try:
+        try:
+            # A hard link on the same filesystem, the data is not copied
+            os.remove(audio_tmp)
+            os.link(audio_path, audio_tmp)
+        except OSError:
+            # The cache is on another filesystem, copy next to the entry instead
+            shutil.copyfile(audio_path, audio_tmp)
+        os.replace(audio_tmp, cached_path)
+        # Write the metadata last and atomically, it marks the entry as complete
+        fd, meta_tmp = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as meta_file:
+            json.dump({"duration": duration}, meta_file)
+        os.replace(meta_tmp, os.path.join(TTS_CACHE_DIR, key + ".json"))
+    except OSError:
+        # Don't leave half-written entries behind
+        for tmp_path in (audio_tmp, meta_tmp):
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    return cached_path
+
+def run_ffmpeg(args: list) -> None:
+    """Run ffmpeg with the given arguments, raising OSError with its output on failure."""
+    from moviepy.config import FFMPEG_BINARY
+    result = subprocess.run([FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *args],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise OSError(f"ffmpeg failed: {result.stderr.strip()}")
+
+def probe_audio_duration(audio_path: str) -> float:
+    """Read the duration of an audio file with a single ffmpeg call, without decoding it."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    return ffmpeg_parse_infos(audio_path)["duration"]
+
+def probe_video(video_path: str) -> dict:
+    """Read the duration and audio presence of a video file, without opening a frame reader."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(video_path)
+    return {"duration": infos["duration"], "has_audio": infos["audio_found"]}
+
+@functools.lru_cache(maxsize=None)
+def hardware_encoder_available(name: str) -> bool:
+    """
+    Check that a hardware encoder works on this machine, by encoding a few
+    frames with it. Being listed by `ffmpeg -encoders` only means it was compiled in.
+    """
+    codec, _ = HARDWARE_ENCODERS[name]
+    try:
+        run_ffmpeg(["-f", "lavfi", "-i", "color=c=black:s=256x256:r=1:d=1", "-c:v", codec, "-f", "null", "-"])
+    except OSError:
+        return False
+    return True
+
+def detect_hardware_encoder():
+    """Get the name of the first working hardware encoder, None if there is none."""
+    return next((name for name in HARDWARE_ENCODERS if hardware_encoder_available(name)), None)
+
+def video_encode_args(encoder: dict) -> list:
+    """ffmpeg video codec arguments for the encoder settings, libx264 unless a hardware encoder is set."""
+    if encoder["name"] in HARDWARE_ENCODERS:
+        codec, rate_control = HARDWARE_ENCODERS[encoder["name"]]
+        return ["-c:v", codec, *(arg.format(crf=encoder["crf"]) for arg in rate_control)]
+    return ["-c:v", "libx264", "-preset", encoder["preset"], "-crf", str(encoder["crf"]),
+            "-threads", str(encoder["threads"])]
+
+def segment_encode_args(fps: int, encoder: dict) -> list:
+    """ffmpeg output arguments shared by every segment."""
+    return [*video_encode_args(encoder), "-pix_fmt", "yuv420p", "-r", str(fps),
+            "-c:a", "aac", "-ar", str(SEGMENT_AUDIO_FPS), "-ac", "2"]
+
+# ffmpeg input of an endless silent track, for segments without sound.
+SILENT_AUDIO_INPUT = ["-f", "lavfi", "-i", f"anullsrc=channel_layout=stereo:sample_rate={SEGMENT_AUDIO_FPS}"]
+
+def render_insert_segment(video_path: str, resolution: tuple, background_color: tuple, duration: float,
+                          has_audio: bool, fps: int, encoder: dict, output_path: str) -> str:
+    """
+    Render a video file over a solid background, at full resolution, to a
+    segment file. ffmpeg composes and encodes it in one pass, no frame goes through Python.
+
+    Args:
+        video_path (str): Path to the video file, placed at the top left corner,
+            and scaled down to fit the frame if larger.
+        resolution (tuple): (width, height) of the segment.
+        background_color (tuple): RGB color around the video.
+        duration (float): Duration of the segment.
+        has_audio (bool): Whether the video file has an audio stream.
+        fps (int): Frame rate of the segment.
+        encoder (dict): Encoder "name", and x264 "preset", "crf" and "threads", shared by every segment.
+        output_path (str): Path of the segment file.
+
+    Returns:
+        str: The path of the segment file.
+    """
+    width, height = resolution
+    color = "0x%02x%02x%02x" % tuple(background_color)
+    audio_input, audio_map = ([], "0:a:0") if has_audio else (SILENT_AUDIO_INPUT, "1:a:0")
+    # Shrink videos larger than the frame while decoding, keeping their aspect ratio, never enlarge them
+    fit = f"[0:v:0]scale='min(iw,{width})':'min(ih,{height})':force_original_aspect_ratio=decrease:flags=area"
+    run_ffmpeg([
+        "-i", video_path, *audio_input,
+        "-filter_complex", f"color=c={color}:s={width}x{height}:r={fps}[bg];{fit}[insert];"
+                           f"[bg][insert]overlay=0:0:shortest=1[v]",
+        "-map", "[v]", "-map", audio_map, "-t", f"{duration:.3f}", "-af", "apad",
+        *segment_encode_args(fps, encoder),
+        output_path,
+    ])
+    return output_path
+
+def render_still_segment(image_path: str, audio_path, duration: float, fps: int, encoder: dict,
+                         output_path: str, video_filter: str = None) -> str:
+    """
+    Encode a still image, with optional audio, straight to a segment file with ffmpeg.
+
+    Args:
+        image_path (str): Path to the full-frame image.
+        audio_path (str or None): Path to the audio, padded with silence up to the duration. None for a silent segment.
+        duration (float): Duration of the segment.
+        fps (int): Frame rate of the segment.
+        encoder (dict): Encoder "name", and x264 "preset", "crf" and "threads", shared by every segment.
+        output_path (str): Path of the segment file.
+        video_filter (str, optional): ffmpeg filter applied to the video. Defaults to None.
+
+    Returns:
+        str: The path of the segment file.
+    """
+    audio_input = SILENT_AUDIO_INPUT if audio_path is None else ["-i", audio_path]
+    filter_args = ["-vf", video_filter] if video_filter else []
+    tune_args = ["-tune", "stillimage"] if encoder["name"] not in HARDWARE_ENCODERS else []
+    run_ffmpeg([
+        "-loop", "1", "-framerate", str(fps), "-i", image_path, *audio_input,
+        "-t", f"{duration:.3f}", "-af", "apad", *filter_args,
+        *segment_encode_args(fps, encoder), *tune_args,
+        output_path,
+    ])
+    return output_path
+
+def render_text_segment(image_path: str, audio_path: str, duration: float, fps: int, encoder: dict,
+                        output_path: str) -> str:
+    """Render a static text frame, fading in and out of black, with its speech to a segment file."""
+    fades = f"fade=t=in:d=0.5,fade=t=out:st={max(duration - 0.5, 0):.3f}:d=0.5"
+    return render_still_segment(image_path, audio_path, duration, fps, encoder, output_path, video_filter=fades)
+
+# Segment renderers, by the "kind" of the segment spec.
+SEGMENT_RENDERERS = {
+    "still": render_still_segment,
+    "text": render_text_segment,
+    "insert": render_insert_segment,
+}
+
+def render_segment(spec: dict, encoder: dict) -> str:
+    """Render the segment described by a spec with the given encoder settings and return its path. Runs in a worker process."""
+    renderer = SEGMENT_RENDERERS[spec["kind"]]
+    spec = {**spec, "duration": max(round(spec["duration"] * spec["fps"]), 1) / spec["fps"]}
+    return renderer(**{key: value for key, value in spec.items() if key != "kind"}, encoder=encoder)
+
+def concat_segments(segment_paths: list, list_path: str, output_path: str) -> str:
+    """Losslessly concatenate segments with identical encoding settings using ffmpeg's concat demuxer."""
+    with open(list_path, "w", encoding="utf-8") as list_file:
+        for segment_path in segment_paths:
+            escaped = os.path.abspath(segment_path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path])
+    return output_path